@@ -1,27 +1,191 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import sqlite3
 import plotly.graph_objects as go
+import plotly.io as pio
 from datetime import datetime
+from io import BytesIO
+from fpdf import FPDF
+
+# orjson serializa arrays numpy ~10x más rápido que el encoder por defecto
+try:
+    import orjson  # noqa: F401
+    pio.json.config.default_engine = "orjson"
+except ImportError:
+    pass
 
 # 1. Configuración de la página
 st.set_page_config(page_title="Monitor de Invernaderos", page_icon="🍄", layout="wide")
 
-# Conexión a Base de Datos
-conn = sqlite3.connect('invernaderos.db', check_same_thread=False)
-c = conn.cursor()
+MESES = ("Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre")
+MES_A_NUM = {nombre: i + 1 for i, nombre in enumerate(MESES)}
+OPCIONES_MES = ("Todos",) + MESES
 
-c.execute('CREATE TABLE IF NOT EXISTS invernaderos (id INTEGER PRIMARY KEY, nombre TEXT)')
-c.execute('''CREATE TABLE IF NOT EXISTS registros 
-             (id INTEGER PRIMARY KEY, inv_id INTEGER, fecha TEXT, hora TEXT, t_max REAL, t_min REAL, h_max REAL, h_min REAL, co2 REAL)''')
-conn.commit()
+# Conexión a Base de Datos (cacheada: una sola conexión por proceso)
+@st.cache_resource
+def get_conn():
+    conn = sqlite3.connect('invernaderos.db', check_same_thread=False)
+    # WAL permite leer mientras se confirma una escritura; NORMAL reduce fsyncs
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA mmap_size=268435456')
+    return conn
 
-# Verificación de columna hora
-try:
-    c.execute('SELECT hora FROM registros LIMIT 1')
-except sqlite3.OperationalError:
-    c.execute('ALTER TABLE registros ADD COLUMN hora TEXT')
+# Esquema y migraciones: se ejecuta una sola vez por proceso, no en cada rerun
+@st.cache_resource
+def ensure_schema():
+    conn = get_conn()
+    # Todo el DDL en un solo lote y una sola transacción
+    # (los índices evitan el escaneo completo en las consultas por invernadero/fecha)
+    conn.executescript('''
+        BEGIN;
+        CREATE TABLE IF NOT EXISTS invernaderos (id INTEGER PRIMARY KEY, nombre TEXT);
+        CREATE TABLE IF NOT EXISTS registros
+            (id INTEGER PRIMARY KEY, inv_id INTEGER, fecha TEXT, hora TEXT, t_max REAL, t_min REAL, h_max REAL, h_min REAL, co2 REAL);
+        CREATE INDEX IF NOT EXISTS idx_registros_inv_fecha ON registros(inv_id, fecha);
+        CREATE INDEX IF NOT EXISTS idx_invernaderos_nombre ON invernaderos(nombre);
+        COMMIT;
+    ''')
+    # Verificación de columna hora (bases creadas antes de que existiera)
+    columnas = {fila[1] for fila in conn.execute('PRAGMA table_info(registros)')}
+    if 'hora' not in columnas:
+        conn.execute('ALTER TABLE registros ADD COLUMN hora TEXT')
+    conn.execute('ANALYZE')
     conn.commit()
+    return True
+
+conn = get_conn()
+c = conn.cursor()
+ensure_schema()
+
+# Lecturas cacheadas: se recalculan solo al cambiar los filtros o tras invalidar
+@st.cache_data(ttl=300, show_spinner=False)
+def get_invernaderos():
+    return pd.read_sql('SELECT id, nombre FROM invernaderos', get_conn())
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_registros(inv_id, mes, año):
+    # Filtro y agregación diaria resueltos en SQLite: solo cruzan ~una fila por día
+    sql = '''SELECT fecha AS fecha_dia,
+                    AVG((t_max + t_min) / 2.0) AS prom_temp,
+                    AVG((h_max + h_min) / 2.0) AS prom_hum,
+                    AVG(co2) AS co2
+             FROM registros
+             WHERE inv_id = ?'''
+    params = [inv_id]
+    if mes != "Todos":
+        sql += " AND strftime('%m', fecha) = ? AND strftime('%Y', fecha) = ?"
+        params += [f"{MES_A_NUM[mes]:02d}", str(int(año))]
+    sql += " GROUP BY fecha ORDER BY fecha"
+    # Backend pyarrow: columnas Arrow sin materializar un PyObject por celda
+    df = pd.read_sql_query(sql, get_conn(), params=tuple(params), dtype_backend="pyarrow")
+    # float32 basta para valores de sensores: mitad de memoria y de bytes por gráfico
+    return df.astype({'prom_temp': 'float32[pyarrow]', 'prom_hum': 'float32[pyarrow]', 'co2': 'float32[pyarrow]'})
+
+@st.cache_data
+def build_climograma(df_diario, titulo):
+    # Construir y serializar la figura es costoso en cada rerun; se cachea por datos+título
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=df_diario['fecha_dia'].to_numpy(), y=df_diario['prom_hum'].to_numpy(), name="Humedad %",
+                         marker_color='rgba(30, 144, 255, 0.3)', yaxis='y2'))
+    fig.add_trace(go.Scatter(x=df_diario['fecha_dia'].to_numpy(), y=df_diario['prom_temp'].to_numpy(), name="Temp °C",
+                             line=dict(color='red', width=3), mode='lines+markers'))
+    fig.update_layout(
+        title=titulo,
+        yaxis=dict(title="Temperatura (°C)", range=[0, 50], dtick=5),
+        yaxis2=dict(title="Humedad (%)", range=[0, 100], dtick=10, overlaying='y', side='right'),
+        hovermode="x unified", legend=dict(orientation="h", y=1.1)
+    )
+    return fig
+
+@st.cache_data
+def build_co2(df_diario, titulo):
+    # Arrays directos a go.Bar: sin set_index ni copia de Series por rerun
+    fig = go.Figure(go.Bar(x=df_diario['fecha_dia'].to_numpy(), y=df_diario['co2'].to_numpy(),
+                           name="CO2 ppm", marker_color='rgba(46, 139, 87, 0.6)'))
+    fig.update_layout(title=titulo, yaxis=dict(title="CO2 (ppm)"), hovermode="x unified")
+    return fig
+
+REGISTROS_POR_PAGINA = 200
+
+@st.cache_data(ttl=300, show_spinner=False)
+def count_registros(inv_id):
+    return get_conn().execute("SELECT COUNT(*) FROM registros WHERE inv_id = ?", (inv_id,)).fetchone()[0]
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_hist(inv_id, pagina=None):
+    # ORDER BY servido por idx_registros_inv_fecha: llega ya ordenado, sin sort en pandas
+    sql = "SELECT id, fecha, hora, t_max, t_min, h_max, h_min, co2 FROM registros WHERE inv_id = ? ORDER BY fecha DESC, hora DESC"
+    params = [inv_id]
+    if pagina is not None:
+        # LIMIT/OFFSET en SQL: solo la página visible sale de SQLite y viaja al navegador
+        sql += " LIMIT ? OFFSET ?"
+        params += [REGISTROS_POR_PAGINA, (pagina - 1) * REGISTROS_POR_PAGINA]
+    df = pd.read_sql_query(sql, get_conn(), params=tuple(params), dtype_backend="pyarrow")
+    return df.astype({col: 'float32[pyarrow]' for col in ('t_max', 't_min', 'h_max', 'h_min', 'co2')})
+
+def add_registros(filas):
+    # Lote completo en una sola transacción: un fsync para N filas, no uno por fila
+    with conn:
+        conn.executemany('INSERT INTO registros (inv_id, fecha, hora, t_max, t_min, h_max, h_min, co2) VALUES (?,?,?,?,?,?,?,?)', filas)
+    load_registros.clear()
+    load_hist.clear()
+    count_registros.clear()
+
+@st.cache_data(show_spinner=False)
+def export_pngs(df_diario, nombre):
+    # PNG en memoria, cacheado por datos: regenerar el PDF sin cambiar filtros no relanza Kaleido
+    fig = build_climograma(df_diario, f"Climograma - {nombre}")
+    fig_co2 = build_co2(df_diario, f"CO2 Diario - {nombre}")
+    return (fig.to_image(format='png', width=900, height=450),
+            fig_co2.to_image(format='png', width=900, height=450))
+
+def formatear_columna(serie, decimales=1):
+    # NULos (p.ej. celdas vacías de un CSV importado) se muestran como '-'
+    valores = serie.to_numpy(dtype='float64')
+    nulos = np.isnan(valores)
+    valores = np.where(nulos, 0.0, valores)
+    if decimales == 0:
+        txt = valores.round().astype('int64').astype(str)
+    else:
+        txt = valores.round(decimales).astype(str)
+    txt[nulos] = '-'
+    return txt
+
+@st.cache_data(show_spinner=False)
+def export_to_pdf(df_hist, nombre, png_climo=None, png_co2=None):
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 14)
+    pdf.cell(0, 10, f"Reporte - {nombre}", align="C")
+    pdf.ln(14)
+
+    # Imágenes vía BytesIO: sin archivos temporales ni os.remove
+    for png in (png_climo, png_co2):
+        if png:
+            pdf.image(BytesIO(png), w=180)
+            pdf.ln(4)
+
+    # Conversión a texto vectorizada: un pase en C por columna, no 7 str() por fila
+    columnas_txt = (df_hist['fecha'].to_numpy(),
+                    df_hist['hora'].fillna('').to_numpy(),
+                    formatear_columna(df_hist['t_max']),
+                    formatear_columna(df_hist['t_min']),
+                    formatear_columna(df_hist['h_max']),
+                    formatear_columna(df_hist['h_min']),
+                    formatear_columna(df_hist['co2'], decimales=0))
+
+    # pdf.table() agrupa bordes y celdas por lotes: una llamada por fila, no 7 .cell()
+    pdf.set_font("Helvetica", "", 9)
+    with pdf.table(col_widths=(30, 20, 24, 24, 24, 24, 28), line_height=6) as tabla:
+        tabla.row(("Fecha", "Hora", "T Max", "T Min", "H Max", "H Min", "CO2"))
+        for celdas in zip(*columnas_txt):
+            tabla.row(celdas)
+
+    return bytes(pdf.output())
 
 st.title("🍄 Panel de Monitoreo Ambiental")
 
@@ -32,19 +196,53 @@ with st.sidebar:
         if nuevo_inv:
             c.execute('INSERT INTO invernaderos (nombre) VALUES (?)', (nuevo_inv,))
             conn.commit()
+            get_invernaderos.clear()
             st.rerun()
 
-    inv_df = pd.read_sql('SELECT * FROM invernaderos', conn)
-    if not inv_df.empty:
-        inv_seleccionado = st.selectbox("Seleccionar Invernadero", inv_df['nombre'])
-        # CORRECCIÓN AQUÍ: Extracción segura del ID
-        inv_id_raw = inv_df[inv_df['nombre'] == inv_seleccionado]['id'].values
-        inv_id = int(inv_id_raw[0]) if len(inv_id_raw) > 0 else None
-        
+    inv_df = get_invernaderos()
+    # Mapa nombre -> id: búsqueda O(1) sin máscara booleana por rerun
+    nombre_a_id = dict(zip(inv_df['nombre'], inv_df['id'].astype(int)))
+    if nombre_a_id:
+        inv_seleccionado = st.selectbox("Seleccionar Invernadero", list(nombre_a_id))
+        inv_id = nombre_a_id.get(inv_seleccionado)
+
         st.subheader("Filtros Temporales")
-        meses = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
-        filtro_mes = st.selectbox("Mes", ["Todos"] + meses)
+        filtro_mes = st.selectbox("Mes", OPCIONES_MES)
         filtro_año = st.number_input("Año", value=datetime.now().year, step=1)
+
+        st.subheader("Carga Masiva")
+        archivo_csv = st.file_uploader("CSV (fecha, hora, t_max, t_min, h_max, h_min, co2)", type="csv")
+        if archivo_csv is not None and st.button("Importar CSV"):
+            try:
+                df_csv = pd.read_csv(archivo_csv)
+            except Exception:
+                st.error("No se pudo leer el archivo CSV")
+                df_csv = None
+            if df_csv is not None:
+                faltantes = [col for col in ('fecha', 'hora', 't_max', 't_min', 'h_max', 'h_min', 'co2')
+                             if col not in df_csv.columns]
+                if faltantes:
+                    st.error(f"Faltan columnas en el CSV: {', '.join(faltantes)}")
+                else:
+                    # Normalizar fecha a ISO: una fecha como 01/02/2026 corrompería
+                    # los filtros strftime y el ORDER BY de todas las lecturas
+                    fechas = pd.to_datetime(df_csv['fecha'], errors='coerce')
+                    invalidas = fechas.isna()
+                    df_ok = pd.DataFrame({
+                        'fecha': fechas.dt.strftime('%Y-%m-%d'),
+                        'hora': df_csv['hora'].where(df_csv['hora'].notna(), None),
+                        't_max': pd.to_numeric(df_csv['t_max'], errors='coerce'),
+                        't_min': pd.to_numeric(df_csv['t_min'], errors='coerce'),
+                        'h_max': pd.to_numeric(df_csv['h_max'], errors='coerce'),
+                        'h_min': pd.to_numeric(df_csv['h_min'], errors='coerce'),
+                        'co2': pd.to_numeric(df_csv['co2'], errors='coerce'),
+                    })[~invalidas]
+                    if invalidas.any():
+                        st.error(f"{int(invalidas.sum())} filas con fecha inválida no se importaron")
+                    filas = [(inv_id, *row) for row in df_ok.itertuples(index=False, name=None)]
+                    if filas:
+                        add_registros(filas)
+                        st.success(f"{len(filas)} registros importados")
     else:
         st.warning("Crea un invernadero para empezar")
         st.stop()
@@ -59,7 +257,7 @@ if inv_id is not None:
                 fecha_reg = st.date_input("Fecha", datetime.now())
             with col_h:
                 hora_reg = st.time_input("Hora del registro", datetime.now().time())
-            
+
             st.divider()
             col1, col2 = st.columns(2)
             with col1:
@@ -69,63 +267,77 @@ if inv_id is not None:
                 h_max = st.number_input("Humedad Máx (%)", value=80.0, step=0.1)
                 h_min = st.number_input("Humedad Mín (%)", value=60.0, step=0.1)
             co2 = st.number_input("CO2 (ppm)", value=600.0, step=10.0)
-            
+
             if st.form_submit_button("Guardar Datos"):
-                c.execute('INSERT INTO registros (inv_id, fecha, hora, t_max, t_min, h_max, h_min, co2) VALUES (?,?,?,?,?,?,?,?)',
-                          (inv_id, str(fecha_reg), str(hora_reg)[:5], t_max, t_min, h_max, h_min, co2))
-                conn.commit()
-                st.success(f"Datos guardados")
+                hora_txt = hora_reg.strftime('%H:%M')
+                # Fecha en ISO (YYYY-MM-DD): ordena y filtra con strftime sin conversión en pandas
+                add_registros([(inv_id, fecha_reg.isoformat(), hora_txt, t_max, t_min, h_max, h_min, co2)])
+                st.success(f"Datos guardados ({hora_txt})")
                 st.balloons()
 
-    with tab2:
-        df = pd.read_sql(f"SELECT * FROM registros WHERE inv_id = {inv_id}", conn)
-        
-        if not df.empty:
-            df['fecha'] = pd.to_datetime(df['fecha'])
-            df['prom_temp'] = (df['t_max'] + df['t_min']) / 2
-            df['prom_hum'] = (df['h_max'] + df['h_min']) / 2
-            
-            if filtro_mes != "Todos":
-                mes_num = meses.index(filtro_mes) + 1
-                df = df[(df['fecha'].dt.month == mes_num) & (df['fecha'].dt.year == filtro_año)]
-            
-            df_diario = df.groupby(df['fecha'].dt.date).agg({
-                'prom_temp': 'mean', 'prom_hum': 'mean', 'co2': 'mean'
-            }).reset_index()
-            df_diario.columns = ['fecha_dia', 'prom_temp', 'prom_hum', 'co2']
-
-            if not df_diario.empty:
-                m1, m2, m3 = st.columns(3)
-                m1.metric("Temp Media", f"{df_diario['prom_temp'].mean():.1f} °C")
-                m2.metric("Hum Media", f"{df_diario['prom_hum'].mean():.1f} %")
-                m3.metric("CO2 Medio", f"{df_diario['co2'].mean():.0f} ppm")
-
-                fig = go.Figure()
-                fig.add_trace(go.Bar(x=df_diario['fecha_dia'], y=df_diario['prom_hum'], name="Humedad %", 
-                                     marker_color='rgba(30, 144, 255, 0.3)', yaxis='y2'))
-                fig.add_trace(go.Scatter(x=df_diario['fecha_dia'], y=df_diario['prom_temp'], name="Temp °C", 
-                                         line=dict(color='red', width=3), mode='lines+markers'))
-                
-                fig.update_layout(
-                    title=f"Climograma - {inv_seleccionado}",
-                    yaxis=dict(title="Temperatura (°C)", range=[0, 50], dtick=5),
-                    yaxis2=dict(title="Humedad (%)", range=[0, 100], dtick=10, overlaying='y', side='right'),
-                    hovermode="x unified", legend=dict(orientation="h", y=1.1)
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.warning("No hay registros en este periodo.")
-        else:
+    # Fragmentos: los widgets internos de cada pestaña re-ejecutan solo su bloque
+    @st.fragment
+    def render_visualizacion(inv_id, nombre, mes, año):
+        # COUNT cacheado antes de agregar: la ruta sin datos no materializa ningún DataFrame
+        if count_registros(inv_id) == 0:
             st.info("Ingresa datos para activar las gráficas.")
+            return
 
-    with tab3:
+        df_diario = load_registros(inv_id, mes, año)
+        if df_diario.empty:
+            st.warning("No hay registros en este periodo.")
+            return
+
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Temp Media", f"{df_diario['prom_temp'].mean():.1f} °C")
+        m2.metric("Hum Media", f"{df_diario['prom_hum'].mean():.1f} %")
+        m3.metric("CO2 Medio", f"{df_diario['co2'].mean():.0f} ppm")
+
+        fig = build_climograma(df_diario, f"Climograma - {nombre}")
+        st.plotly_chart(fig, use_container_width=True, theme=None)
+
+        fig_co2 = build_co2(df_diario, f"CO2 Diario - {nombre}")
+        st.plotly_chart(fig_co2, use_container_width=True, theme=None)
+
+    @st.fragment
+    def render_historial(inv_id, nombre, mes, año):
         st.subheader("Historial")
-        df_hist = pd.read_sql(f"SELECT id, fecha, hora, t_max, t_min, h_max, h_min, co2 FROM registros WHERE inv_id = {inv_id}", conn)
-        st.dataframe(df_hist.sort_values(by=['fecha', 'hora'], ascending=False), use_container_width=True, hide_index=True)
-        
+        total = count_registros(inv_id)
+        paginas = max(1, -(-total // REGISTROS_POR_PAGINA))
+        pagina = st.number_input("Página", min_value=1, max_value=paginas, step=1)
+        df_hist = load_hist(inv_id, pagina)
+        st.caption(f"Página {pagina} de {paginas} — {total} registros")
+        st.dataframe(df_hist, use_container_width=True, hide_index=True)
+
+        if not df_hist.empty:
+            df_diario = load_registros(inv_id, mes, año)
+            png_climo, png_co2 = None, None
+            if not df_diario.empty:
+                # Sin Chrome disponible, kaleido lanza RuntimeError: el PDF sale sin gráficas
+                try:
+                    png_climo, png_co2 = export_pngs(df_diario, nombre)
+                except Exception:
+                    st.caption("Gráficas omitidas del PDF (exportación de imágenes no disponible)")
+            # El PDF siempre lleva el historial completo, no solo la página visible
+            st.download_button("📄 Descargar PDF", data=export_to_pdf(load_hist(inv_id), nombre, png_climo, png_co2),
+                               file_name=f"reporte_{nombre}.pdf", mime="application/pdf")
+
         with st.expander("Borrar registro"):
             id_borrar = st.number_input("ID a eliminar", step=1, min_value=0)
             if st.button("Eliminar"):
-                c.execute("DELETE FROM registros WHERE id = ?", (id_borrar,))
-                conn.commit()
-                st.rerun()
+                # Sondeo O(1) por clave primaria: valida sin cargar el historial
+                if conn.execute("SELECT 1 FROM registros WHERE id = ? LIMIT 1", (id_borrar,)).fetchone() is None:
+                    st.error("No existe un registro con ese ID")
+                else:
+                    c.execute("DELETE FROM registros WHERE id = ?", (id_borrar,))
+                    conn.commit()
+                    load_registros.clear()
+                    load_hist.clear()
+                    count_registros.clear()
+                    st.rerun()
+
+    with tab2:
+        render_visualizacion(inv_id, inv_seleccionado, filtro_mes, filtro_año)
+
+    with tab3:
+        render_historial(inv_id, inv_seleccionado, filtro_mes, filtro_año)